@@ -3,6 +3,8 @@ Circuit Solving Agent - Streamlit Application
 """
 import streamlit as st
 import asyncio
+import hashlib
+import threading
 import time
 from PIL import Image
 import io
@@ -11,8 +13,10 @@ import io
 from config.settings import settings
 from models.circuit_analysis import AnalysisRequest
 from chain.circuit_analysis_chain import CircuitAnalysisChain
-from utils.image_utils import validate_image_format, optimize_image_for_analysis, get_image_info
+from services.gemini_service import GeminiService
+from utils.image_utils import validate_image_format, optimize_image_for_analysis, get_image_info, create_image_thumbnail, downscale_image
 from utils.image_enhancement import auto_enhance_circuit_image, create_enhancement_comparison
+from utils.validation_engine import CircuitValidationEngine
 
 # Page configuration
 st.set_page_config(
@@ -62,6 +66,153 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+@st.cache_resource
+def get_validation_engine() -> CircuitValidationEngine:
+    """Shared validation engine, built once per process."""
+    return CircuitValidationEngine()
+
+@st.cache_resource
+def get_chain(api_key: str) -> CircuitAnalysisChain:
+    """
+    Build the analysis chain once per API key and reuse it across reruns.
+    
+    The chain's service sends every request with this key, whichever key
+    other sessions or later reruns have entered since.
+    """
+    return CircuitAnalysisChain(gemini_service=GeminiService(api_key),
+                                validation_engine=get_validation_engine())
+
+@st.cache_data(ttl=60, show_spinner=False)
+def check_connection(api_key: str) -> bool:
+    """Test the Gemini connection, reusing the result for a minute per key."""
+    return get_chain(api_key).test_chain()
+
+@st.cache_resource
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Long-lived event loop running in a daemon thread.
+    
+    Reusing one loop keeps async clients created on it (and their
+    connections) alive between analyses, which asyncio.run would tear down.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="analysis-loop", daemon=True).start()
+    return loop
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def enhance_upload(image_hash: str, _image_data: bytes):
+    """
+    Auto-enhance an upload, cached across reruns by content hash.
+    
+    Large uploads are first downscaled to settings.ENHANCEMENT_MAX_SIZE; the
+    OpenCV cost grows with pixel count and Gemini gets a smaller copy anyway.
+    The scale used is recorded as enhancement_info['scale_factor'].
+    
+    The leading underscore keeps Streamlit from hashing the image bytes;
+    image_hash alone identifies the content.
+    """
+    working_image, scale_factor = downscale_image(_image_data, settings.ENHANCEMENT_MAX_SIZE)
+    enhanced_image, enhancement_info = auto_enhance_circuit_image(working_image)
+    enhancement_info['scale_factor'] = scale_factor
+    return enhanced_image, enhancement_info
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def comparison_preview(image_hash: str, _image_data: bytes, _enhanced_image: bytes) -> bytes:
+    """Before/after comparison preview, cached across reruns by content hash."""
+    comparison_image = create_enhancement_comparison(_image_data, _enhanced_image)
+    return create_image_thumbnail(comparison_image, settings.PREVIEW_MAX_SIZE)
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def inspect_upload(image_hash: str, _image_data: bytes):
+    """
+    Info, validation result and display preview for an upload.
+    
+    All three come from a single Image.open, and are cached by content
+    hash so reruns neither re-parse nor re-decode the upload.
+    
+    Returns:
+        Tuple of (image_info, (is_valid, validation_msg), preview); the last
+        two are None if the image could not be read, and preview alone is
+        None if its pixel data could not be decoded
+    """
+    try:
+        image = Image.open(io.BytesIO(_image_data))
+    except Exception:
+        image = None
+    
+    image_info = get_image_info(_image_data, image)
+    if 'error' in image_info:
+        return image_info, None, None
+    validation = validate_image_format(_image_data, image)
+    
+    # Downscaled RGB preview; thumbnailing the still-unloaded image lets
+    # JPEGs decode at reduced scale. This is the first full decode, so a
+    # truncated or corrupt file whose header parses fails here
+    try:
+        image.thumbnail(settings.PREVIEW_MAX_SIZE, Image.Resampling.LANCZOS)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+    except Exception:
+        return image_info, validation, None
+    return image_info, validation, image
+
+def render_upload(uploaded_file) -> None:
+    """Show info, preview and enhancement for one uploaded image."""
+    # Read the upload once; getvalue() shares the uploader's buffer
+    # instead of copying it
+    image_data = uploaded_file.getvalue()
+    image_hash = hashlib.blake2b(image_data, digest_size=16).hexdigest()
+    image_info, validation, preview = inspect_upload(image_hash, image_data)
+    
+    # Display image info
+    
+    if 'error' not in image_info:
+        st.success(f"✅ Image uploaded successfully!")
+        st.info(f"""
+        **Format:** {image_info['format']}  
+        **Size:** {image_info['width']} × {image_info['height']} pixels  
+        **File size:** {image_info['file_size_mb']:.2f} MB
+        """)
+        
+        # Display original image as a downscaled preview; the full-resolution
+        # bytes are only needed for the analysis itself
+        if preview is not None:
+            st.image(preview, caption="Original Circuit Image",
+                     width="stretch", output_format="JPEG")
+        
+        # Auto-enhance and show comparison
+        with st.spinner("🔧 Enhancing image quality..."):
+            enhanced_image, enhancement_info = enhance_upload(image_hash, image_data)
+            
+            if enhancement_info.get('enhancements_applied'):
+                st.success("✨ Image enhanced automatically!")
+                
+                # Build the comparison only when asked for; expander bodies
+                # run on every rerun even while collapsed, a toggle does not
+                if st.toggle("🔍 Show before/after comparison", key=f"compare_{uploaded_file.file_id}"):
+                    st.image(comparison_preview(image_hash, image_data, enhanced_image),
+                             caption="Original vs Enhanced", width="stretch")
+                
+                # Show enhancement details
+                st.info(f"""
+                **Enhancements Applied:** {', '.join(enhancement_info['enhancements_applied'])}
+                **Quality Score:** {enhancement_info.get('quality_score', 0):.2f}/1.0
+                """)
+            else:
+                st.info("✅ Image quality is good - no enhancements needed")
+            
+            # Store enhanced image for analysis
+            st.session_state.enhanced_uploads[uploaded_file.file_id] = (enhanced_image, enhancement_info)
+        
+        # Validate image
+        is_valid, validation_msg = validation
+        if is_valid:
+            st.success(validation_msg)
+        else:
+            st.error(validation_msg)
+    else:
+        st.error(f"❌ Error reading image: {image_info['error']}")
+
 def main():
     """Main application function."""
     
@@ -87,8 +238,7 @@ def main():
             # Test connection
             if st.button("Test Connection"):
                 try:
-                    chain = CircuitAnalysisChain()
-                    if chain.test_chain():
+                    if check_connection(settings.GEMINI_API_KEY):
                         st.success("✅ Connection successful!")
                     else:
                         st.error("❌ Connection failed!")
@@ -105,7 +255,7 @@ def main():
         """)
         
         st.markdown("### 📁 Supported Formats")
-        st.markdown(f"**Image formats:** {', '.join(settings.SUPPORTED_FORMATS)}")
+        st.markdown(f"**Image formats:** {settings.SUPPORTED_FORMATS_DISPLAY}")
         st.markdown(f"**Max size:** {settings.MAX_IMAGE_SIZE // (1024*1024)} MB")
         
         st.markdown("---")
@@ -131,60 +281,27 @@ def main():
         st.header("📤 Upload Circuit Image")
         
         # File uploader
-        uploaded_file = st.file_uploader(
-            "Choose a circuit image",
-            type=['jpg', 'jpeg', 'png', 'bmp', 'tiff'],
-            help="Upload a clear image of your circuit for analysis"
+        uploaded_files = st.file_uploader(
+            "Choose circuit images",
+            type=settings.UPLOADER_TYPES,
+            accept_multiple_files=True,
+            help="Upload clear images of your circuits for analysis"
         )
         
-        if uploaded_file is not None:
-            # Display image info
-            image_data = uploaded_file.read()
-            image_info = get_image_info(image_data)
-            
-            if 'error' not in image_info:
-                st.success(f"✅ Image uploaded successfully!")
-                st.info(f"""
-                **Format:** {image_info['format']}  
-                **Size:** {image_info['width']} × {image_info['height']} pixels  
-                **File size:** {image_info['file_size_mb']:.2f} MB
-                """)
-                
-                # Display original image
-                image = Image.open(io.BytesIO(image_data))
-                st.image(image, caption="Original Circuit Image", use_column_width=True)
-                
-                # Auto-enhance and show comparison
-                with st.spinner("🔧 Enhancing image quality..."):
-                    enhanced_image, enhancement_info = auto_enhance_circuit_image(image_data)
-                    
-                    if enhancement_info.get('enhancements_applied'):
-                        st.success("✨ Image enhanced automatically!")
-                        
-                        # Create and show comparison
-                        comparison_image = create_enhancement_comparison(image_data, enhanced_image)
-                        st.image(comparison_image, caption="Original vs Enhanced", use_column_width=True)
-                        
-                        # Show enhancement details
-                        st.info(f"""
-                        **Enhancements Applied:** {', '.join(enhancement_info['enhancements_applied'])}
-                        **Quality Score:** {enhancement_info.get('quality_score', 0):.2f}/1.0
-                        """)
-                        
-                        # Store enhanced image for analysis
-                        st.session_state.enhanced_image = enhanced_image
-                    else:
-                        st.info("✅ Image quality is good - no enhancements needed")
-                        st.session_state.enhanced_image = image_data
-                
-                # Validate image
-                is_valid, validation_msg = validate_image_format(image_data)
-                if is_valid:
-                    st.success(validation_msg)
-                else:
-                    st.error(validation_msg)
+        # Drop enhanced images of files that are no longer uploaded so the
+        # session only ever holds the current uploads
+        current_ids = {uploaded_file.file_id for uploaded_file in uploaded_files}
+        enhanced_uploads = st.session_state.setdefault('enhanced_uploads', {})
+        for file_id in enhanced_uploads.keys() - current_ids:
+            del enhanced_uploads[file_id]
+        
+        if uploaded_files:
+            if len(uploaded_files) == 1:
+                render_upload(uploaded_files[0])
             else:
-                st.error(f"❌ Error reading image: {image_info['error']}")
+                for tab, uploaded_file in zip(st.tabs([f.name for f in uploaded_files]), uploaded_files):
+                    with tab:
+                        render_upload(uploaded_file)
     
     with col2:
         st.header("🔍 Analysis Options")
@@ -205,7 +322,7 @@ def main():
         )
         
         # Analyze button
-        if st.button("🚀 Analyze Circuit", type="primary", disabled=not uploaded_file):
+        if st.button("🚀 Analyze Circuit", type="primary", disabled=not uploaded_files):
             if not settings.validate_config():
                 st.error("❌ Please configure your Gemini API key in the sidebar!")
                 return
@@ -213,25 +330,43 @@ def main():
             # Show progress
             with st.spinner("🔍 Analyzing circuit..."):
                 try:
-                    # Use enhanced image if available, otherwise use original
-                    analysis_image = st.session_state.get('enhanced_image', image_data)
+                    # Create one analysis request per upload; the chain skips
+                    # enhancing again when the upload step already did it
+                    enhanced_uploads = st.session_state.get('enhanced_uploads', {})
+                    requests = []
+                    for uploaded_file in uploaded_files:
+                        enhanced = enhanced_uploads.get(uploaded_file.file_id)
+                        if enhanced is not None:
+                            analysis_image, enhancement_info = enhanced
+                        else:
+                            analysis_image, enhancement_info = uploaded_file.getvalue(), None
+                        requests.append(AnalysisRequest(
+                            image_data=analysis_image,
+                            additional_context=additional_context,
+                            analysis_depth=analysis_depth,
+                            already_enhanced=enhanced is not None,
+                            enhancement_info=enhancement_info
+                        ))
                     
-                    # Create analysis request
-                    request = AnalysisRequest(
-                        image_data=analysis_image,
-                        additional_context=additional_context,
-                        analysis_depth=analysis_depth
+                    # Execute analyses concurrently
+                    chain = get_chain(settings.GEMINI_API_KEY)
+                    future = asyncio.run_coroutine_threadsafe(
+                        chain.execute_analysis_many(requests), get_event_loop()
                     )
+                    responses = future.result()
                     
-                    # Execute analysis
-                    chain = CircuitAnalysisChain()
-                    response = asyncio.run(chain.execute_analysis(request))
+                    # The enhanced bytes are not needed once the analysis is
+                    # done; the next rerun rebuilds them from the cache
+                    st.session_state.pop('enhanced_uploads', None)
                     
                     # Display results
-                    if response.success:
-                        display_analysis_results(response)
+                    if len(responses) == 1:
+                        display_response(responses[0])
                     else:
-                        st.error(f"❌ Analysis failed: {response.error_message}")
+                        tabs = st.tabs([f.name for f in uploaded_files])
+                        for index, (tab, response) in enumerate(zip(tabs, responses)):
+                            with tab:
+                                display_response(response, key=f"analysis_{index}")
                         
                 except Exception as e:
                     st.error(f"❌ Unexpected error: {str(e)}")
@@ -243,7 +378,14 @@ def main():
         unsafe_allow_html=True
     )
 
-def display_analysis_results(response):
+def display_response(response, key: str = "analysis"):
+    """Display an analysis response, or its error if the analysis failed."""
+    if response.success:
+        display_analysis_results(response, key=key)
+    else:
+        st.error(f"❌ Analysis failed: {response.error_message}")
+
+def display_analysis_results(response, key: str = "analysis"):
     """Display the analysis results in a structured format."""
     
     st.success("🎉 Circuit analysis completed successfully!")
@@ -331,8 +473,7 @@ def display_analysis_results(response):
         validation_results = response.validation_results
         
         with st.expander("🔍 View Detailed Validation Report"):
-            from utils.validation_engine import CircuitValidationEngine
-            validation_engine = CircuitValidationEngine()
+            validation_engine = get_validation_engine()
             validation_report = validation_engine.generate_validation_report(validation_results)
             st.markdown(validation_report)
             
@@ -347,10 +488,21 @@ def display_analysis_results(response):
                 for warning in validation_results['warnings']:
                     st.warning(f"• {warning}")
     
-    # Download results option
-    if st.button("📥 Download Analysis Report"):
-        # Create a comprehensive text report
-        report = f"""
+    # Download results option; the report is only built when clicked
+    st.download_button(
+        label="📥 Download Analysis Report",
+        data=lambda: _build_report(response),
+        file_name=f"circuit_analysis_{int(time.time())}.txt",
+        mime="text/plain",
+        key=f"{key}_download",
+        on_click="ignore"
+    )
+
+def _build_report(response) -> str:
+    """Build the downloadable text report for an analysis response."""
+    analysis = response.analysis
+    buf = io.StringIO()
+    buf.write(f"""
 Circuit Analysis Report
 ======================
 
@@ -370,39 +522,37 @@ ANALYSIS SUMMARY:
 {analysis.analysis_summary}
 
 CALCULATIONS:
-{chr(10).join(analysis.calculations) if analysis.calculations else 'No calculations provided'}
-
-COMPONENTS:
-{chr(10).join([f"- {c.name}: {c.value}" for c in analysis.components]) if analysis.components else 'No components listed'}
-
-VALIDATION RESULTS:
-"""
-        
-        # Add validation information to report
-        if hasattr(response, 'validation_results') and response.validation_results:
-            validation_results = response.validation_results
-            if validation_results.get('errors'):
-                report += f"❌ ERRORS: {len(validation_results['errors'])} found\n"
-                for error in validation_results['errors']:
-                    report += f"  - {error}\n"
-            
-            if validation_results.get('warnings'):
-                report += f"⚠️ WARNINGS: {len(validation_results['warnings'])} found\n"
-                for warning in validation_results['warnings']:
-                    report += f"  - {warning}\n"
-            
-            if validation_results.get('confidence_adjustment') != 0:
-                report += f"📊 Confidence Adjustment: {validation_results['confidence_adjustment']:+.2f}\n"
+""")
+    if analysis.calculations:
+        buf.writelines(f"{calc}\n" for calc in analysis.calculations)
+    else:
+        buf.write("No calculations provided\n")
+    
+    buf.write("\nCOMPONENTS:\n")
+    if analysis.components:
+        buf.writelines(f"- {c.name}: {c.value}\n" for c in analysis.components)
+    else:
+        buf.write("No components listed\n")
+    
+    buf.write("\nVALIDATION RESULTS:\n")
+    
+    # Add validation information to report
+    if hasattr(response, 'validation_results') and response.validation_results:
+        validation_results = response.validation_results
+        if validation_results.get('errors'):
+            buf.write(f"❌ ERRORS: {len(validation_results['errors'])} found\n")
+            buf.writelines(f"  - {error}\n" for error in validation_results['errors'])
         
-        report += "\n" + "=" * 50 + "\n"
-        report += "Report generated by Circuit Solving Agent with AI validation"
+        if validation_results.get('warnings'):
+            buf.write(f"⚠️ WARNINGS: {len(validation_results['warnings'])} found\n")
+            buf.writelines(f"  - {warning}\n" for warning in validation_results['warnings'])
         
-        st.download_button(
-            label="📄 Download Report",
-            data=report,
-            file_name=f"circuit_analysis_{int(time.time())}.txt",
-            mime="text/plain"
-        )
+        if validation_results.get('confidence_adjustment') != 0:
+            buf.write(f"📊 Confidence Adjustment: {validation_results['confidence_adjustment']:+.2f}\n")
+    
+    buf.write("\n" + "=" * 50 + "\n")
+    buf.write("Report generated by Circuit Solving Agent with AI validation")
+    return buf.getvalue()
 
 if __name__ == "__main__":
     main()
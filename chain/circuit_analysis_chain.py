@@ -2,20 +2,28 @@
 Circuit analysis chain that orchestrates the analysis workflow.
 """
 import asyncio
-from typing import Optional
+from typing import List, Optional
 from models.circuit_analysis import AnalysisRequest, AnalysisResponse
 from services.gemini_service import GeminiService
 from config.settings import settings
-from utils.image_enhancement import auto_enhance_circuit_image
+from utils.image_enhancement import auto_enhance_circuit_image_cached
+from utils.image_utils import optimize_image_for_analysis
 from utils.validation_engine import CircuitValidationEngine
 
 class CircuitAnalysisChain:
     """Main chain for circuit analysis workflow."""
     
-    def __init__(self):
-        """Initialize the analysis chain."""
-        self.gemini_service = GeminiService()
-        self.validation_engine = CircuitValidationEngine()
+    def __init__(self, gemini_service: Optional[GeminiService] = None,
+                 validation_engine: Optional[CircuitValidationEngine] = None):
+        """
+        Initialize the analysis chain.
+        
+        Args:
+            gemini_service: Service to use instead of building a new one
+            validation_engine: Engine to use instead of building a new one
+        """
+        self.gemini_service = gemini_service or GeminiService()
+        self.validation_engine = validation_engine or CircuitValidationEngine()
     
     async def execute_analysis(self, request: AnalysisRequest) -> AnalysisResponse:
         """
@@ -35,23 +43,37 @@ class CircuitAnalysisChain:
                     processing_time=0.0
                 )
             
-            # Step 2: Auto-enhance image if needed
-            enhanced_image, enhancement_info = auto_enhance_circuit_image(request.image_data)
+            # Step 2: Auto-enhance image unless the caller already did
+            if request.already_enhanced:
+                enhanced_image, enhancement_info = request.image_data, request.enhancement_info
+            else:
+                # OpenCV work is CPU-bound; run it in a thread while the
+                # Gemini connection warms up
+                (enhanced_image, enhancement_info), _ = await asyncio.gather(
+                    asyncio.to_thread(auto_enhance_circuit_image_cached, request.image_data),
+                    self.gemini_service.ensure_ready()
+                )
+            
+            # Step 3: Downscale and JPEG-encode before upload; the vision model
+            # gains nothing from more than ~1024px and the payload shrinks a lot
+            analysis_image = await asyncio.to_thread(optimize_image_for_analysis, enhanced_image)
             
-            # Step 3: Execute analysis with enhanced image
+            # Step 4: Execute analysis with enhanced image
             enhanced_request = AnalysisRequest(
-                image_data=enhanced_image,
+                image_data=analysis_image,
                 additional_context=request.additional_context,
-                analysis_depth=request.analysis_depth
+                analysis_depth=request.analysis_depth,
+                already_enhanced=True,
+                enhancement_info=enhancement_info
             )
             
             response = await self.gemini_service.analyze_circuit(enhanced_request)
             
-            # Step 4: Post-process results if successful
+            # Step 5: Post-process results if successful
             if response.success and response.analysis:
                 response.analysis = self._enhance_analysis(response.analysis)
                 
-                # Step 5: Validate results for accuracy
+                # Step 6: Validate results for accuracy
                 validation_results = self.validation_engine.validate_analysis(response.analysis)
                 response.validation_results = validation_results
                 
@@ -72,6 +94,21 @@ class CircuitAnalysisChain:
                 processing_time=0.0
             )
     
+    async def execute_analysis_many(self, requests: List[AnalysisRequest]) -> List[AnalysisResponse]:
+        """
+        Execute several analyses concurrently.
+        
+        At most settings.MAX_CONCURRENT_ANALYSES run at once; responses are
+        returned in the same order as the requests.
+        """
+        semaphore = asyncio.Semaphore(settings.MAX_CONCURRENT_ANALYSES)
+        
+        async def _run_one(request: AnalysisRequest) -> AnalysisResponse:
+            async with semaphore:
+                return await self.execute_analysis(request)
+        
+        return await asyncio.gather(*(_run_one(request) for request in requests))
+    
     def _validate_request(self, request: AnalysisRequest) -> bool:
         """Validate the analysis request."""
         if not request.image_data:
@@ -2,6 +2,8 @@
 Configuration settings for the Circuit Solving Agent.
 """
 import os
+import string
+from functools import lru_cache
 from typing import Optional
 from dotenv import load_dotenv
 
@@ -33,10 +35,15 @@ class Settings:
     
     # Image Processing
     MAX_IMAGE_SIZE: int = 10 * 1024 * 1024  # 10MB
-    SUPPORTED_FORMATS: list = [".jpg", ".jpeg", ".png", ".bmp", ".tiff"]
+    SUPPORTED_FORMATS: frozenset = frozenset({".jpg", ".jpeg", ".png", ".bmp", ".tiff"})
+    SUPPORTED_FORMATS_DISPLAY: str = ".jpg, .jpeg, .png, .bmp, .tiff"
+    UPLOADER_TYPES: tuple = ("jpg", "jpeg", "png", "bmp", "tiff")  # st.file_uploader form
+    PREVIEW_MAX_SIZE: tuple = (800, 800)  # Bounding box for on-page previews
+    ENHANCEMENT_MAX_SIZE: int = 1600  # Working resolution for auto-enhancement
     
     # Analysis Configuration
-    ANALYSIS_PROMPT_TEMPLATE: str = """
+    MAX_CONCURRENT_ANALYSES: int = 10  # Parallel Gemini calls for multi-image uploads
+    ANALYSIS_PROMPT_TEMPLATE: string.Template = string.Template("""
     You are an expert electrical engineer and circuit analyst with extensive experience in analyzing various types of circuit images, including blurry photos and handwritten diagrams.
     
     Analyze the uploaded circuit image and provide a comprehensive solution. Pay special attention to:
@@ -71,7 +78,9 @@ class Settings:
     Present your analysis in a clear, structured format suitable for engineering students.
     Use proper electrical engineering terminology and show all calculations.
     If any part is unclear due to image quality, clearly state your assumptions and confidence level.
-    """
+    
+    **Requested Analysis Depth:** $analysis_depth
+    """)
     
     @classmethod
     def validate_config(cls) -> bool:
@@ -82,3 +91,20 @@ class Settings:
 
 # Global settings instance
 settings = Settings()
+
+@lru_cache(maxsize=16)
+def _depth_prompt(analysis_depth: str) -> str:
+    """Render the analysis prompt template, once per distinct depth."""
+    return settings.ANALYSIS_PROMPT_TEMPLATE.substitute(analysis_depth=analysis_depth)
+
+def render_analysis_prompt(analysis_depth: str, additional_context: Optional[str] = None) -> str:
+    """
+    Build the full analysis prompt.
+    
+    The depth-specific part is cached and always comes first, so the prompt
+    prefix is identical across requests; user context is appended last.
+    """
+    prompt = _depth_prompt(analysis_depth)
+    if additional_context:
+        prompt += f"\n\nAdditional Context: {additional_context}"
+    return prompt
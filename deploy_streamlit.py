@@ -8,8 +8,19 @@ import os
 import sys
 import subprocess
 import shutil
+import importlib.util
+from functools import lru_cache
 from pathlib import Path
 
+@lru_cache(maxsize=None)
+def has_module(import_name):
+    """Check whether a module is installed without importing it."""
+    try:
+        return importlib.util.find_spec(import_name) is not None
+    except (ImportError, ValueError):
+        # Raised when a parent package is missing
+        return False
+
 def check_requirements():
     """Check if all required packages are installed."""
     print("🔍 Checking requirements...")
@@ -25,10 +36,9 @@ def check_requirements():
     
     missing_packages = []
     for package_name, import_name in required_packages:
-        try:
-            __import__(import_name)
+        if has_module(import_name):
             print(f"✅ {package_name}")
-        except ImportError:
+        else:
             missing_packages.append(package_name)
             print(f"❌ {package_name}")
     
@@ -40,6 +50,16 @@ def check_requirements():
     print("✅ All requirements satisfied!")
     return True
 
+@lru_cache(maxsize=None)
+def load_secrets(secrets_file, mtime_ns):
+    """Parse a secrets.toml file; mtime_ns is part of the cache key only."""
+    try:
+        import tomllib
+    except ImportError:
+        import tomli as tomllib
+    with open(secrets_file, "rb") as f:
+        return tomllib.load(f)
+
 def check_api_key():
     """Check if Gemini API key is configured."""
     print("\n🔑 Checking API key configuration...")
@@ -49,31 +69,49 @@ def check_api_key():
         print("✅ API key found in environment variables")
         return True
     
-    # Check Streamlit secrets
-    try:
-        import streamlit as st
-        if hasattr(st, 'secrets') and st.secrets.get("GEMINI_API_KEY"):
-            print("✅ API key found in Streamlit secrets")
+    # Check the secrets files Streamlit reads, without importing Streamlit
+    for secrets_file in (Path(".streamlit/secrets.toml"), Path.home() / ".streamlit" / "secrets.toml"):
+        if not secrets_file.is_file():
+            continue
+        try:
+            secrets = load_secrets(secrets_file, secrets_file.stat().st_mtime_ns)
+        except ImportError:
+            # No TOML parser (Python < 3.11 without tomli); trust the file
+            print(f"✅ API key found in {secrets_file}")
+            return True
+        except Exception as e:
+            print(f"⚠️ Could not read {secrets_file}: {e}")
+            continue
+        if secrets.get("GEMINI_API_KEY"):
+            print(f"✅ API key found in {secrets_file}")
             return True
-    except ImportError:
-        pass
-    
-    # Check .streamlit/secrets.toml
-    secrets_file = Path(".streamlit/secrets.toml")
-    if secrets_file.exists():
-        print("✅ API key found in .streamlit/secrets.toml")
-        return True
     
     print("❌ No API key found!")
     print("Please set GEMINI_API_KEY environment variable or add it to .streamlit/secrets.toml")
     return False
 
-def test_app_import():
-    """Test if the app can be imported successfully."""
+# Local packages app.py imports from; compiled along with it by test_app_import
+APP_PACKAGES = ("config", "models", "services", "chain", "utils")
+
+def test_app_import(deep=False):
+    """
+    Test if the app can be imported successfully.
+    
+    By default the app and its local packages are only compiled, which
+    catches syntax errors without loading Streamlit, OpenCV or the Gemini
+    SDK. With deep=True the app is actually imported.
+    """
     print("\n🧪 Testing app import...")
     
     try:
-        import app
+        if deep:
+            import app
+        else:
+            sources = [Path("app.py")]
+            for package in APP_PACKAGES:
+                sources.extend(sorted(Path(package).glob("*.py")))
+            for source in sources:
+                compile(source.read_text(encoding="utf-8"), str(source), "exec")
         print("✅ App imports successfully!")
         return True
     except Exception as e:
@@ -96,12 +134,14 @@ def run_local():
         print("📍 Network URL: http://YOUR_IP:8501")
         print("\nPress Ctrl+C to stop the app")
         
-        # Run streamlit
-        subprocess.run([
-            sys.executable, "-m", "streamlit", "run", "app.py",
+        # Run streamlit in this interpreter rather than a second one;
+        # the CLI exits the process when the server stops
+        from streamlit.web import cli as stcli
+        stcli.main([
+            "run", "app.py",
             "--server.port", "8501",
             "--server.address", "localhost"
-        ])
+        ], prog_name="streamlit")
         
     except KeyboardInterrupt:
         print("\n🛑 App stopped by user")
@@ -157,21 +197,23 @@ def main():
         print("  python deploy_streamlit.py local     - Run locally")
         print("  python deploy_streamlit.py deploy   - Prepare for Streamlit Cloud")
         print("  python deploy_streamlit.py check    - Check system status")
+        print("\nAdd --deep to fully import the app instead of only compiling it")
         return
     
     command = sys.argv[1].lower()
+    deep = "--deep" in sys.argv[2:]
     
     if command == "check":
         check_requirements()
         check_api_key()
-        test_app_import()
+        test_app_import(deep)
         
     elif command == "local":
         if not check_requirements():
             return
         if not check_api_key():
             return
-        if not test_app_import():
+        if not test_app_import(deep):
             return
         run_local()
         
@@ -180,7 +222,7 @@ def main():
             return
         if not check_api_key():
             return
-        if not test_app_import():
+        if not test_app_import(deep):
             return
         prepare_deployment()
         
@@ -2,8 +2,6 @@
 """
 Simple launcher for the Circuit Solving Agent
 """
-import subprocess
-import sys
 import time
 import os
 
@@ -24,13 +22,15 @@ def main():
         print("Press Ctrl+C to stop the app")
         print("-" * 50)
         
-        # Launch the app
-        result = subprocess.run([
-            sys.executable, "-m", "streamlit", "run", "app.py",
+        # Launch the app in this interpreter rather than a second one;
+        # the CLI exits the process when the server stops
+        from streamlit.web import cli as stcli
+        stcli.main([
+            "run", "app.py",
             "--server.port", "8501",
             "--server.address", "localhost",
             "--server.fileWatcherType", "none"
-        ], capture_output=False)
+        ], prog_name="streamlit")
         
     except KeyboardInterrupt:
         print("\n🛑 App stopped by user")
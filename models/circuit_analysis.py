@@ -32,6 +32,8 @@ class AnalysisRequest(BaseModel):
     image_data: bytes = Field(..., description="Circuit image data")
     additional_context: Optional[str] = Field(None, description="Additional context or specific question")
     analysis_depth: str = Field(default="comprehensive", description="Depth of analysis required")
+    already_enhanced: bool = Field(default=False, description="Whether image_data has already been auto-enhanced")
+    enhancement_info: Optional[Dict[str, Any]] = Field(None, description="Enhancement information for an already enhanced image")
 
 class AnalysisResponse(BaseModel):
     """Response from circuit analysis."""
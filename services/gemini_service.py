@@ -1,38 +1,123 @@
 """
 Gemini API service for circuit analysis.
 """
+import re
 import time
 import base64
 from typing import Optional, Tuple
-import google.generativeai as genai
 from PIL import Image
 import io
 
-from config.settings import settings
+from config.settings import settings, render_analysis_prompt
 from models.circuit_analysis import AnalysisRequest, AnalysisResponse, CircuitAnalysis
 
+# Section headings recognised by _extract_analysis_from_response, in
+# priority order: the first pattern found anywhere in a line wins. The
+# lookaheads are anchored at the line start; unanchored, search() retries
+# them at every position, quadratic in the line length
+_SECTION_PATTERNS = (
+    ("circuit_type", re.compile(r'\A(?=.*circuit)(?=.*(?:type|identification))', re.IGNORECASE)),
+    ("components", re.compile(r'component', re.IGNORECASE)),
+    ("calculations", re.compile(r'calculation', re.IGNORECASE)),
+    ("solution", re.compile(r'solution|answer|final|result', re.IGNORECASE)),
+    ("confidence", re.compile(r'confidence', re.IGNORECASE)),
+)
+_MARKDOWN_RE = re.compile(r'[*`]+')
+_SOLUTION_PREFIX_RE = re.compile(r'(?:final answer|solution|answer|result):', re.IGNORECASE)
+
+# Image formats passed to Gemini as encoded bytes by _prepare_image, with
+# the MIME type to send them as. Multi-picture "MPO" photos are JPEG data;
+# PIL's own image/mpo type is not one Gemini accepts
+_BLOB_FORMATS = {"JPEG": "image/jpeg", "MPO": "image/jpeg", "PNG": "image/png"}
+
 class GeminiService:
     """Service for interacting with Gemini API for circuit analysis."""
     
-    def __init__(self):
-        """Initialize Gemini service."""
-        if not settings.validate_config():
+    def __init__(self, api_key: Optional[str] = None):
+        """
+        Initialize Gemini service.
+        
+        Args:
+            api_key: Gemini API key; defaults to settings.GEMINI_API_KEY
+        """
+        api_key = api_key or settings.GEMINI_API_KEY
+        if not api_key:
             raise ValueError("Gemini API key not configured")
         
-        genai.configure(api_key=settings.GEMINI_API_KEY)
+        # Imported here rather than at module level: the SDK (and the gRPC
+        # stack behind it) is slow to load and only needed once a service exists
+        from google.generativeai import client
+        # The service's own client manager rather than genai.configure: that
+        # one is process-wide, so every service would send its requests with
+        # whichever key was configured last
+        self._clients = client._ClientManager()
+        self._clients.configure(api_key=api_key)
         # Use the correct model name format
         model_name = settings.GEMINI_MODEL
         if not model_name.startswith('models/'):
             model_name = f'models/{model_name}'
-        self.model = genai.GenerativeModel(model_name)
+        self.model = self._new_model(model_name)
+        self._ready = False
+        # Built on first use and kept, like self.model
+        self._fallback_model = None
+        self._test_model = None
+    
+    def _new_model(self, model_name: str):
+        """Build a model that sends its requests through this service's clients."""
+        # Relies on SDK internals, checked against google-generativeai 0.8.0
+        # and 0.8.6 (the minimum in requirements.txt follows): the
+        # client._ClientManager class, and the GenerativeModel._client and
+        # _async_client attributes, which the model only fills in from the
+        # process-wide manager while they are still None
+        import google.generativeai as genai
+        model = genai.GenerativeModel(model_name)
+        model._client = self._clients.get_default_client("generative")
+        return model
+    
+    def _bind_async(self, model):
+        """
+        Give model this service's async client before an async call.
+        
+        The gRPC async client binds to the event loop it is created on, so it
+        is made here, on the running loop, rather than in __init__.
+        """
+        if model._async_client is None:
+            model._async_client = self._clients.get_default_client("generative_async")
+        return model
+    
+    async def ensure_ready(self) -> None:
+        """
+        Open the async API connection ahead of the first analysis.
         
-    def _prepare_image(self, image_data: bytes) -> Image.Image:
-        """Prepare image for Gemini API."""
+        Runs once per service with a (free) token count request, which makes
+        the SDK create its async client on the running loop. Failures are
+        ignored since the analysis call itself reports any real problem.
+        """
+        if self._ready:
+            return
+        try:
+            await self._bind_async(self.model).count_tokens_async("ping")
+            self._ready = True
+        except Exception as e:
+            print(f"Warm-up error: {e}")
+        
+    def _prepare_image(self, image_data: bytes):
+        """
+        Prepare image for Gemini API.
+        
+        JPEG and PNG data is sent as-is in a blob. A PIL image would be
+        decoded and re-encoded as lossless WebP by the SDK, synchronously on
+        the event loop, and several times larger than the JPEG. Other formats
+        are left to that conversion.
+        """
         try:
             image = Image.open(io.BytesIO(image_data))
-            return image
         except Exception as e:
             raise ValueError(f"Invalid image format: {str(e)}")
+        mime_type = _BLOB_FORMATS.get(image.format)
+        if mime_type is not None:
+            return {"mime_type": mime_type, "data": image_data}
+        return image
     
     def _extract_analysis_from_response(self, response: str) -> CircuitAnalysis:
         """Extract structured analysis from Gemini response."""
@@ -48,37 +133,30 @@ class GeminiService:
         confidence_level = 0.8
         
         # Try to extract structured information
-        lines = response.split('\n')
         current_section = ""
         solution_lines = []
         
-        for line in lines:
+        for line in response.split('\n'):
             line = line.strip()
             if not line:
                 continue
                 
             # Detect sections
-            if "circuit" in line.lower() and ("type" in line.lower() or "identification" in line.lower()):
-                current_section = "circuit_type"
-            elif "component" in line.lower():
-                current_section = "components"
-            elif "calculation" in line.lower():
-                current_section = "calculations"
-            elif any(keyword in line.lower() for keyword in ["solution", "answer", "final", "result"]):
-                current_section = "solution"
-            elif "confidence" in line.lower():
-                current_section = "confidence"
+            for section, pattern in _SECTION_PATTERNS:
+                if pattern.search(line):
+                    current_section = section
+                    break
             
             # Extract information based on current section
             if current_section == "circuit_type" and ":" in line:
-                circuit_type = line.split(":", 1)[1].strip()
-            elif current_section == "calculations" and line and not line.startswith('#'):
+                circuit_type = line.partition(":")[2].strip()
+            elif current_section == "calculations" and not line.startswith('#'):
                 calculations.append(line)
             elif current_section == "solution":
                 # Collect all solution lines
-                if line and not line.startswith('#'):
+                if not line.startswith('#'):
                     # Clean up markdown formatting
-                    clean_line = line.replace('**', '').replace('*', '').replace('`', '')
+                    clean_line = _MARKDOWN_RE.sub('', line)
                     if clean_line.strip():
                         solution_lines.append(clean_line)
         
@@ -86,10 +164,9 @@ class GeminiService:
         if solution_lines:
             solution = ' '.join(solution_lines)
             # Remove common prefixes like "Final Answer:", "Solution:", etc.
-            for prefix in ["final answer:", "solution:", "answer:", "result:"]:
-                if solution.lower().startswith(prefix):
-                    solution = solution[len(prefix):].strip()
-                    break
+            prefix = _SOLUTION_PREFIX_RE.match(solution)
+            if prefix:
+                solution = solution[prefix.end():].strip()
         
         return CircuitAnalysis(
             circuit_type=circuit_type,
@@ -109,19 +186,19 @@ class GeminiService:
             image = self._prepare_image(request.image_data)
             
             # Prepare prompt
-            prompt = settings.ANALYSIS_PROMPT_TEMPLATE
-            if request.additional_context:
-                prompt += f"\n\nAdditional Context: {request.additional_context}"
+            prompt = render_analysis_prompt(request.analysis_depth, request.additional_context)
             
-            # Generate response from Gemini
+            # Generate response from Gemini; the native async call shares the
+            # SDK's async client instead of blocking the event loop
             try:
-                response = self.model.generate_content([prompt, image])
+                response = await self._bind_async(self.model).generate_content_async([prompt, image])
             except Exception as e:
                 print(f"Image analysis error: {e}")
                 # Try with a different model if the first one fails
                 try:
-                    fallback_model = genai.GenerativeModel("models/gemini-1.5-flash")
-                    response = fallback_model.generate_content([prompt, image])
+                    if self._fallback_model is None:
+                        self._fallback_model = self._new_model("models/gemini-1.5-flash")
+                    response = await self._bind_async(self._fallback_model).generate_content_async([prompt, image])
                 except Exception as e2:
                     print(f"Fallback model also failed: {e2}")
                     raise e
@@ -153,8 +230,9 @@ class GeminiService:
         """Test Gemini API connection."""
         try:
             # Simple test with text generation
-            test_model = genai.GenerativeModel("models/gemini-1.5-pro")
-            response = test_model.generate_content("Hello")
+            if self._test_model is None:
+                self._test_model = self._new_model("models/gemini-1.5-pro")
+            response = self._test_model.generate_content("Hello")
             return response.text is not None
         except Exception as e:
             print(f"Connection test error: {e}")
@@ -0,0 +1,16 @@
+"""
+Shared test setup.
+
+config.settings reads st.secrets at import time, which raises when no
+secrets.toml exists; point Streamlit at an empty one and supply a key
+through the environment instead.
+"""
+import os
+import tempfile
+
+from streamlit import config
+
+_secrets_file = tempfile.NamedTemporaryFile(suffix=".toml", delete=False)
+_secrets_file.close()
+config.set_option("secrets.files", [_secrets_file.name])
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
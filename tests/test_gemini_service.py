@@ -0,0 +1,43 @@
+"""
+Tests for the Gemini service's response parsing.
+"""
+import time
+
+import pytest
+
+from services.gemini_service import GeminiService
+
+
+@pytest.fixture
+def service():
+    return GeminiService(api_key="test-key")
+
+
+def test_extracts_sections(service):
+    response = (
+        "## Circuit Type\n"
+        "Circuit type: Voltage divider\n"
+        "## Calculations\n"
+        "Vout = 5V * 1k / (1k + 1k) = 2.5V\n"
+        "## Final Answer\n"
+        "**Final Answer:** Vout = 2.5V\n"
+    )
+    analysis = service._extract_analysis_from_response(response)
+    
+    assert analysis.circuit_type == "Voltage divider"
+    assert analysis.calculations == ["Vout = 5V * 1k / (1k + 1k) = 2.5V"]
+    assert analysis.solution == "Vout = 2.5V"
+
+
+def test_long_lines_parse_in_linear_time(service):
+    # Long paragraph lines with no section heading; an unanchored lookahead
+    # pattern takes seconds on a line this size
+    line = "The current flows through each element in turn. " * 400
+    response = "\n".join([line] * 2)
+    
+    start = time.perf_counter()
+    analysis = service._extract_analysis_from_response(response)
+    elapsed = time.perf_counter() - start
+    
+    assert analysis.circuit_type == "Unknown Circuit"
+    assert elapsed < 0.5
@@ -0,0 +1,38 @@
+"""
+Tests for image validation and optimization.
+"""
+import io
+
+import pytest
+from PIL import Image
+
+from services.gemini_service import GeminiService
+from utils.image_utils import optimize_image_for_analysis, validate_image_format
+
+
+@pytest.fixture
+def mpo_data():
+    """Two-picture MPO file, as saved by many phone cameras."""
+    main = Image.new("RGB", (400, 300), "white")
+    second = Image.new("RGB", (400, 300), "black")
+    output = io.BytesIO()
+    main.save(output, format="MPO", save_all=True, append_images=[second])
+    return output.getvalue()
+
+
+def test_mpo_opens_as_mpo(mpo_data):
+    assert Image.open(io.BytesIO(mpo_data)).format == "MPO"
+
+
+def test_mpo_is_valid(mpo_data):
+    assert validate_image_format(mpo_data)[0]
+    assert validate_image_format(mpo_data, Image.open(io.BytesIO(mpo_data)))[0]
+
+
+def test_mpo_within_bounds_passes_through(mpo_data):
+    assert optimize_image_for_analysis(mpo_data, max_size=1024) is mpo_data
+
+
+def test_mpo_is_sent_as_jpeg(mpo_data):
+    blob = GeminiService(api_key="test-key")._prepare_image(mpo_data)
+    assert blob == {"mime_type": "image/jpeg", "data": mpo_data}
@@ -1,12 +1,122 @@
 """
 Image enhancement utilities for handling blurry photos and handwritten circuits.
 """
-import cv2
-import numpy as np
+from __future__ import annotations
+
 from PIL import Image, ImageEnhance, ImageFilter
 import io
+import copy
+import hashlib
+import threading
+from collections import OrderedDict
 from typing import Tuple, Optional
 
+# OpenCV and NumPy are a large share of app start-up time, so they are only
+# imported (by _load_cv) the first time an image is actually enhanced
+cv2 = None
+np = None
+_cv_lock = threading.Lock()
+
+# Results of auto_enhance_circuit_image_cached, keyed by input digest
+_ENHANCE_CACHE_SIZE = 32
+_enhance_cache: "OrderedDict[bytes, Tuple[bytes, dict]]" = OrderedDict()
+_enhance_cache_lock = threading.Lock()
+
+# Enhancement kernels, built once by _load_cv; they are only ever read
+_SHARPEN_KERNEL = None
+_HORIZONTAL_KERNEL = None
+_VERTICAL_KERNEL = None
+
+# CLAHE keeps scratch buffers between apply() calls, so each thread
+# (Streamlit sessions, asyncio.to_thread workers) gets its own instance
+_clahe_local = threading.local()
+
+def _load_cv() -> None:
+    """Import OpenCV and NumPy and build the enhancement kernels, once."""
+    global cv2, np, _SHARPEN_KERNEL, _HORIZONTAL_KERNEL, _VERTICAL_KERNEL
+    if cv2 is not None:
+        return
+    with _cv_lock:
+        if cv2 is not None:
+            return
+        import numpy
+        _SHARPEN_KERNEL = numpy.array([[-1,-1,-1], [-1,9,-1], [-1,-1,-1]], dtype=numpy.float32)
+        _HORIZONTAL_KERNEL = numpy.ones((1, 15), numpy.uint8)
+        _VERTICAL_KERNEL = numpy.ones((15, 1), numpy.uint8)
+        np = numpy
+        # Bound last: other threads take `cv2 is not None` to mean ready
+        import cv2 as opencv
+        cv2 = opencv
+
+def _get_clahe():
+    """Per-thread CLAHE instance used for contrast enhancement."""
+    clahe = getattr(_clahe_local, 'clahe', None)
+    if clahe is None:
+        clahe = _clahe_local.clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
+    return clahe
+
+def _decode_bgr(image_data: bytes) -> np.ndarray:
+    """
+    Decode image data straight into an OpenCV BGR array.
+    
+    EXIF orientation is ignored so the result lines up with the PIL-decoded
+    original shown next to it.
+    """
+    cv_image = cv2.imdecode(np.frombuffer(image_data, np.uint8),
+                            cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+    if cv_image is None:
+        raise ValueError("Could not decode image data")
+    return cv_image
+
+def _encode_jpeg(image: np.ndarray) -> bytes:
+    """Encode a BGR or grayscale array as JPEG bytes."""
+    ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 95, cv2.IMWRITE_JPEG_OPTIMIZE, 1])
+    if not ok:
+        raise ValueError("JPEG encoding failed")
+    return buffer.tobytes()
+
+def _enhance_blurry_np(cv_image: np.ndarray) -> np.ndarray:
+    """Blur-reduction pipeline on a BGR array; returns a BGR array."""
+    # 1. Unsharp masking for sharpening
+    gaussian = cv2.GaussianBlur(cv_image, (0, 0), 2.0)
+    sharpened = cv2.addWeighted(cv_image, 1.5, gaussian, -0.5, 0)
+    
+    # 2. Contrast enhancement
+    lab = cv2.cvtColor(sharpened, cv2.COLOR_BGR2LAB)
+    l, a, b = cv2.split(lab)
+    l = _get_clahe().apply(l)
+    enhanced_lab = cv2.merge([l, a, b])
+    enhanced = cv2.cvtColor(enhanced_lab, cv2.COLOR_LAB2BGR)
+    
+    # 3. Noise reduction; an edge-preserving bilateral filter is enough for
+    # line art and far cheaper than non-local means patch matching
+    denoised = cv2.bilateralFilter(enhanced, d=7, sigmaColor=50, sigmaSpace=50)
+    
+    # 4. Edge enhancement
+    return cv2.filter2D(denoised, -1, _SHARPEN_KERNEL)
+
+def _enhance_handwritten_np(cv_image: np.ndarray) -> np.ndarray:
+    """Handwritten-circuit pipeline on a BGR array; returns a grayscale array."""
+    # 1. Convert to grayscale for better processing
+    gray = cv2.cvtColor(cv_image, cv2.COLOR_BGR2GRAY)
+    
+    # 2. Apply adaptive thresholding for better text/line detection
+    thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
+                                 cv2.THRESH_BINARY, 11, 2)
+    
+    # 3. Line enhancement for circuit connections; the 1-D kernels make
+    # each opening a single row or column pass. (A closing with a 1x1
+    # kernel used to run first, but that leaves the image unchanged.)
+    horizontal_lines = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, _HORIZONTAL_KERNEL)
+    vertical_lines = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, _VERTICAL_KERNEL)
+    
+    # Combine horizontal and vertical lines; both are 0/255 masks, so the
+    # saturating sum is their union
+    lines = cv2.bitwise_or(horizontal_lines, vertical_lines)
+    
+    # 4. Enhance contrast for better readability
+    return cv2.convertScaleAbs(lines, alpha=1.5, beta=30)
+
 def enhance_blurry_image(image_data: bytes) -> bytes:
     """
     Enhance blurry circuit images using various techniques.
@@ -18,38 +128,8 @@ def enhance_blurry_image(image_data: bytes) -> bytes:
         Enhanced image data as bytes
     """
     try:
-        # Convert PIL image to OpenCV format
-        pil_image = Image.open(io.BytesIO(image_data))
-        cv_image = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
-        
-        # Apply multiple enhancement techniques
-        
-        # 1. Unsharp masking for sharpening
-        gaussian = cv2.GaussianBlur(cv_image, (0, 0), 2.0)
-        sharpened = cv2.addWeighted(cv_image, 1.5, gaussian, -0.5, 0)
-        
-        # 2. Contrast enhancement
-        lab = cv2.cvtColor(sharpened, cv2.COLOR_BGR2LAB)
-        l, a, b = cv2.split(lab)
-        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
-        l = clahe.apply(l)
-        enhanced_lab = cv2.merge([l, a, b])
-        enhanced = cv2.cvtColor(enhanced_lab, cv2.COLOR_LAB2BGR)
-        
-        # 3. Noise reduction
-        denoised = cv2.fastNlMeansDenoisingColored(enhanced, None, 10, 10, 7, 21)
-        
-        # 4. Edge enhancement
-        kernel = np.array([[-1,-1,-1], [-1,9,-1], [-1,-1,-1]])
-        edge_enhanced = cv2.filter2D(denoised, -1, kernel)
-        
-        # Convert back to PIL and save
-        enhanced_pil = Image.fromarray(cv2.cvtColor(edge_enhanced, cv2.COLOR_BGR2RGB))
-        output = io.BytesIO()
-        enhanced_pil.save(output, format='JPEG', quality=95, optimize=True)
-        
-        return output.getvalue()
-        
+        _load_cv()
+        return _encode_jpeg(_enhance_blurry_np(_decode_bgr(image_data)))
     except Exception as e:
         # Return original if enhancement fails
         return image_data
@@ -65,41 +145,8 @@ def enhance_handwritten_circuit(image_data: bytes) -> bytes:
         Enhanced image data as bytes
     """
     try:
-        # Convert PIL image to OpenCV format
-        pil_image = Image.open(io.BytesIO(image_data))
-        cv_image = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
-        
-        # 1. Convert to grayscale for better processing
-        gray = cv2.cvtColor(cv_image, cv2.COLOR_BGR2GRAY)
-        
-        # 2. Apply adaptive thresholding for better text/line detection
-        thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-                                     cv2.THRESH_BINARY, 11, 2)
-        
-        # 3. Morphological operations to clean up the image
-        kernel = np.ones((1,1), np.uint8)
-        cleaned = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
-        
-        # 4. Line enhancement for circuit connections
-        kernel_horizontal = np.ones((1, 15), np.uint8)
-        kernel_vertical = np.ones((15, 1), np.uint8)
-        
-        horizontal_lines = cv2.morphologyEx(cleaned, cv2.MORPH_OPEN, kernel_horizontal)
-        vertical_lines = cv2.morphologyEx(cleaned, cv2.MORPH_OPEN, kernel_vertical)
-        
-        # Combine horizontal and vertical lines
-        lines = cv2.addWeighted(horizontal_lines, 1, vertical_lines, 1, 0)
-        
-        # 5. Enhance contrast for better readability
-        enhanced = cv2.convertScaleAbs(lines, alpha=1.5, beta=30)
-        
-        # Convert back to PIL and save
-        enhanced_pil = Image.fromarray(enhanced)
-        output = io.BytesIO()
-        enhanced_pil.save(output, format='JPEG', quality=95, optimize=True)
-        
-        return output.getvalue()
-        
+        _load_cv()
+        return _encode_jpeg(_enhance_handwritten_np(_decode_bgr(image_data)))
     except Exception as e:
         # Return original if enhancement fails
         return image_data
@@ -108,6 +155,9 @@ def auto_enhance_circuit_image(image_data: bytes) -> Tuple[bytes, dict]:
     """
     Automatically detect and enhance circuit images based on quality issues.
     
+    The image is decoded once and passed between the enhancement stages as
+    an array; it is only encoded back to JPEG at the end.
+    
     Args:
         image_data: Original image data
         
@@ -115,9 +165,8 @@ def auto_enhance_circuit_image(image_data: bytes) -> Tuple[bytes, dict]:
         Tuple of (enhanced_image_data, enhancement_info)
     """
     try:
-        # Convert to PIL for analysis
-        pil_image = Image.open(io.BytesIO(image_data))
-        cv_image = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
+        _load_cv()
+        cv_image = _decode_bgr(image_data)
         gray = cv2.cvtColor(cv_image, cv2.COLOR_BGR2GRAY)
         
         enhancement_info = {
@@ -131,26 +180,35 @@ def auto_enhance_circuit_image(image_data: bytes) -> Tuple[bytes, dict]:
         laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
         blur_threshold = 100.0
         
+        result = cv_image
         if laplacian_var < blur_threshold:
             enhancement_info['blur_detected'] = True
             enhancement_info['enhancements_applied'].append('blur_reduction')
-            image_data = enhance_blurry_image(image_data)
+            result = _enhance_blurry_np(result)
         
         # 2. Detect handwritten characteristics
         # Look for irregular patterns and text-like features
         edges = cv2.Canny(gray, 50, 150)
-        edge_density = np.sum(edges > 0) / (edges.shape[0] * edges.shape[1])
+        edge_density = cv2.countNonZero(edges) / edges.size
         
         # Handwritten circuits typically have more irregular edges
         if edge_density > 0.1 and laplacian_var < 200:
             enhancement_info['handwritten_detected'] = True
             enhancement_info['enhancements_applied'].append('handwritten_enhancement')
-            image_data = enhance_handwritten_circuit(image_data)
+            result = _enhance_handwritten_np(result)
+        
+        if enhancement_info['enhancements_applied']:
+            image_data = _encode_jpeg(result)
         
-        # 3. Calculate quality score
-        enhanced_pil = Image.open(io.BytesIO(image_data))
-        enhanced_cv = cv2.cvtColor(np.array(enhanced_pil), cv2.COLOR_RGB2BGR)
-        enhanced_gray = cv2.cvtColor(enhanced_cv, cv2.COLOR_BGR2GRAY)
+        # 3. Calculate quality score, on the result array rather than a
+        # decode of the bytes just encoded (the handwritten path is already
+        # grayscale, and an unenhanced image is the input we measured above)
+        if result is cv_image:
+            enhanced_gray = gray
+        elif result.ndim == 2:
+            enhanced_gray = result
+        else:
+            enhanced_gray = cv2.cvtColor(result, cv2.COLOR_BGR2GRAY)
         
         # Quality metrics
         sharpness = cv2.Laplacian(enhanced_gray, cv2.CV_64F).var()
@@ -170,6 +228,36 @@ def auto_enhance_circuit_image(image_data: bytes) -> Tuple[bytes, dict]:
             'quality_score': 0.0
         }
 
+def auto_enhance_circuit_image_cached(image_data: bytes) -> Tuple[bytes, dict]:
+    """
+    Memoized auto_enhance_circuit_image, keyed by a BLAKE2b digest of the input.
+    
+    Only the digest is kept as the key, so cached entries don't hold on to
+    the input bytes. At most _ENHANCE_CACHE_SIZE results are kept.
+    
+    Args:
+        image_data: Original image data
+        
+    Returns:
+        Tuple of (enhanced_image_data, enhancement_info); the info is a copy
+        the caller is free to modify
+    """
+    key = hashlib.blake2b(image_data, digest_size=16).digest()
+    with _enhance_cache_lock:
+        cached = _enhance_cache.get(key)
+        if cached is not None:
+            _enhance_cache.move_to_end(key)
+    
+    if cached is None:
+        cached = auto_enhance_circuit_image(image_data)
+        with _enhance_cache_lock:
+            _enhance_cache[key] = cached
+            if len(_enhance_cache) > _ENHANCE_CACHE_SIZE:
+                _enhance_cache.popitem(last=False)
+    
+    enhanced_data, enhancement_info = cached
+    return enhanced_data, copy.deepcopy(enhancement_info)
+
 def create_enhancement_comparison(original_data: bytes, enhanced_data: bytes) -> bytes:
     """
     Create a side-by-side comparison of original vs enhanced image.
@@ -185,20 +273,23 @@ def create_enhancement_comparison(original_data: bytes, enhanced_data: bytes) ->
         original_pil = Image.open(io.BytesIO(original_data))
         enhanced_pil = Image.open(io.BytesIO(enhanced_data))
         
-        # Resize both images to same height for comparison
+        # Resize both images to same height for comparison, keeping aspect
+        # ratio (the enhanced image may be a downscaled working copy)
         height = min(original_pil.height, enhanced_pil.height)
-        width = original_pil.width + enhanced_pil.width
+        original_width = round(original_pil.width * height / original_pil.height)
+        enhanced_width = round(enhanced_pil.width * height / enhanced_pil.height)
+        width = original_width + enhanced_width
         
         # Create comparison image
         comparison = Image.new('RGB', (width, height), 'white')
         
-        # Resize and paste original
-        original_resized = original_pil.resize((original_pil.width, height), Image.Resampling.LANCZOS)
-        comparison.paste(original_resized, (0, 0))
-        
-        # Resize and paste enhanced
-        enhanced_resized = enhanced_pil.resize((enhanced_pil.width, height), Image.Resampling.LANCZOS)
-        comparison.paste(enhanced_resized, (original_pil.width, 0))
+        # Paste both sides; only the taller image needs resizing, the other
+        # already has the target size
+        for side, side_width, x in ((original_pil, original_width, 0),
+                                    (enhanced_pil, enhanced_width, original_width)):
+            if side.size != (side_width, height):
+                side = side.resize((side_width, height), Image.Resampling.LANCZOS)
+            comparison.paste(side, (x, 0))
         
         # Add labels
         from PIL import ImageDraw, ImageFont
@@ -211,7 +302,7 @@ def create_enhancement_comparison(original_data: bytes, enhanced_data: bytes) ->
             font = ImageFont.load_default()
         
         draw.text((10, 10), "Original", fill='black', font=font)
-        draw.text((original_pil.width + 10, 10), "Enhanced", fill='black', font=font)
+        draw.text((original_width + 10, 10), "Enhanced", fill='black', font=font)
         
         # Save comparison
         output = io.BytesIO()
@@ -2,30 +2,116 @@
 Utility functions for image processing and validation.
 """
 import io
+import struct
 from typing import Tuple, Optional
 from PIL import Image
 from config.settings import settings
 
-def validate_image_format(image_data: bytes) -> Tuple[bool, str]:
+# PIL format names matching settings.SUPPORTED_FORMATS
+SUPPORTED_PIL_FORMATS = frozenset({"JPEG", "MPO", "PNG", "BMP", "TIFF"})
+
+# PIL formats that are JPEG data. Multi-picture photos, as many phone
+# cameras save them, open as "MPO": a JPEG main image followed by the others
+JPEG_PIL_FORMATS = frozenset({"JPEG", "MPO"})
+
+# Largest image validate_image_format accepts. Pillow warns when opening
+# anything bigger and refuses (DecompressionBombError) past twice this,
+# before any pixels are allocated.
+Image.MAX_IMAGE_PIXELS = 4000 * 4000
+
+def sniff_image_format(image_data: bytes) -> Optional[str]:
+    """
+    Detect a supported image format from its magic bytes.
+    
+    Returns:
+        PIL format name, or None if the data is not a supported format
+    """
+    if image_data[:3] == b'\xff\xd8\xff':
+        return 'JPEG'
+    if image_data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'PNG'
+    if image_data[:2] == b'BM':
+        return 'BMP'
+    if image_data[:4] in (b'II*\x00', b'MM\x00*'):
+        return 'TIFF'
+    return None
+
+# JPEG start-of-frame markers; every other SOFn-range code (DHT, JPG, DAC)
+# is an ordinary segment
+_JPEG_SOF_MARKERS = frozenset({0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+                               0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF})
+
+def _quick_image_info(image_data: bytes) -> Optional[Tuple[str, int, int]]:
+    """
+    Read format and dimensions straight from a PNG or JPEG header.
+    
+    Returns:
+        Tuple of (PIL format name, width, height), or None for other formats
+        or headers that can't be parsed this way
+    """
+    try:
+        if image_data[:8] == b'\x89PNG\r\n\x1a\n' and image_data[12:16] == b'IHDR':
+            width, height = struct.unpack_from('>II', image_data, 16)
+            return 'PNG', width, height
+        
+        if image_data[:3] == b'\xff\xd8\xff':
+            # Walk the marker segments up to the start-of-frame
+            pos = 2
+            while True:
+                while image_data[pos] != 0xFF:
+                    pos += 1
+                while image_data[pos] == 0xFF:
+                    pos += 1
+                marker = image_data[pos]
+                pos += 1
+                if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+                    continue  # standalone marker, no length field
+                if marker in (0xD9, 0xDA):
+                    return None  # end of image or scan data before any frame
+                if marker in _JPEG_SOF_MARKERS:
+                    height, width = struct.unpack_from('>HH', image_data, pos + 3)
+                    return 'JPEG', width, height
+                pos += struct.unpack_from('>H', image_data, pos)[0]
+    except (IndexError, struct.error):
+        pass
+    return None
+
+def validate_image_format(image_data: bytes, image: Optional[Image.Image] = None) -> Tuple[bool, str]:
     """
     Validate image format and return validation result.
     
+    Args:
+        image_data: Original image data
+        image: Already opened image for image_data, to avoid decoding it again
+        
     Returns:
         Tuple[bool, str]: (is_valid, error_message)
     """
+    unsupported = f"Unsupported image format. Supported formats: {settings.SUPPORTED_FORMATS_DISPLAY}"
     try:
-        image = Image.open(io.BytesIO(image_data))
+        if image is not None:
+            image_format, width, height = image.format, image.width, image.height
+        else:
+            # Reject unsupported data from its magic bytes before involving
+            # PIL, and read PNG/JPEG dimensions without it altogether
+            if sniff_image_format(image_data) is None:
+                return False, unsupported
+            header = _quick_image_info(image_data)
+            if header is None:
+                image = Image.open(io.BytesIO(image_data))
+                header = image.format, image.width, image.height
+            image_format, width, height = header
         
-        # Check if image format is supported
-        format_lower = image.format.lower() if image.format else ""
-        if not any(format_lower.endswith(fmt.lower()) for fmt in settings.SUPPORTED_FORMATS):
-            return False, f"Unsupported image format. Supported formats: {', '.join(settings.SUPPORTED_FORMATS)}"
+        # Check if image format is supported; format and size come from the
+        # header, so no pixel data is decoded here
+        if image_format not in SUPPORTED_PIL_FORMATS:
+            return False, unsupported
         
         # Check image dimensions
-        if image.width < 100 or image.height < 100:
+        if width < 100 or height < 100:
             return False, "Image dimensions too small. Minimum size: 100x100 pixels"
         
-        if image.width > 4000 or image.height > 4000:
+        if width > 4000 or height > 4000:
             return False, "Image dimensions too large. Maximum size: 4000x4000 pixels"
         
         return True, "Image validation successful"
@@ -46,36 +132,85 @@ def optimize_image_for_analysis(image_data: bytes, max_size: int = 1024) -> byte
     """
     try:
         image = Image.open(io.BytesIO(image_data))
+        resize = image.width > max_size or image.height > max_size
+        
+        # An RGB JPEG within bounds is already what we would produce; pass
+        # it through unless an EXIF rotation would be dropped by re-encoding
+        if (not resize and image.format in JPEG_PIL_FORMATS and image.mode == 'RGB'
+                and image.getexif().get(0x0112, 1) == 1):
+            return image_data
         
         # Resize if image is too large
-        if image.width > max_size or image.height > max_size:
+        if resize:
             # Maintain aspect ratio
             ratio = min(max_size / image.width, max_size / image.height)
             new_size = (int(image.width * ratio), int(image.height * ratio))
+            # Let libjpeg decode at the largest 1/2, 1/4 or 1/8 scale that
+            # still covers new_size; LANCZOS does the precise final step
+            if image.format in JPEG_PIL_FORMATS:
+                image.draft('RGB', new_size)
             image = image.resize(new_size, Image.Resampling.LANCZOS)
         
         # Convert to RGB if necessary (Gemini works better with RGB)
         if image.mode != 'RGB':
             image = image.convert('RGB')
         
-        # Save optimized image
+        # Save optimized image; the extra Huffman pass is only worth it
+        # for the resized (previously oversized) images
         output = io.BytesIO()
-        image.save(output, format='JPEG', quality=85, optimize=True)
+        image.save(output, format='JPEG', quality=85, optimize=resize)
         return output.getvalue()
         
     except Exception as e:
         # Return original if optimization fails
         return image_data
 
-def get_image_info(image_data: bytes) -> dict:
+def downscale_image(image_data: bytes, max_size: int, quality: int = 92) -> Tuple[bytes, float]:
+    """
+    Downscale an image so that its longest edge is at most max_size.
+    
+    Args:
+        image_data: Original image data
+        max_size: Maximum dimension size
+        quality: JPEG quality of the downscaled copy
+        
+    Returns:
+        Tuple of (image_data, scale_factor); the original data and 1.0 if the
+        image is already small enough
+    """
+    try:
+        image = Image.open(io.BytesIO(image_data))
+        if image.width <= max_size and image.height <= max_size:
+            return image_data, 1.0
+        
+        original_width = image.width
+        image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=quality)
+        return output.getvalue(), image.width / original_width
+        
+    except Exception as e:
+        # Return original if downscaling fails
+        return image_data, 1.0
+
+def get_image_info(image_data: bytes, image: Optional[Image.Image] = None) -> dict:
     """
     Get basic information about the image.
     
+    Args:
+        image_data: Original image data
+        image: Already opened image for image_data, to avoid decoding it again
+        
     Returns:
         Dictionary with image information
     """
     try:
-        image = Image.open(io.BytesIO(image_data))
+        # Image.open only reads the header; the pixel data is never decoded
+        if image is None:
+            image = Image.open(io.BytesIO(image_data))
         return {
             'format': image.format,
             'mode': image.mode,
@@ -2,44 +2,103 @@
 Validation engine for circuit analysis results to ensure accuracy and reliability.
 """
 import re
+from functools import lru_cache
 from typing import Dict, List, Tuple, Any
 from models.circuit_analysis import CircuitAnalysis, CircuitComponent
 
+# Quantities quoted in the analysis summary, e.g. "power = 2.5 W": the
+# keyword, then the first number after the next "=" on the same line
+_QUANTITY_RE = re.compile(
+    r'(?P<kind>power|voltage|current|resistance)[^=\n]*=[^\d\n]*(?P<value>\d+\.?\d*)',
+    re.IGNORECASE
+)
+
+# Component values: number, optional SI prefix, unit letters, e.g. "100 ohm",
+# "10k", "47μF", "1.5V", "100mA", "10 kiloohm". Values arrive lowercased, so
+# "m" is milli and "meg" mega, as in SPICE. Both micro signs are accepted.
+# Spelled-out prefixes come first so "micro" is not read as "m" + "icro".
+_COMPONENT_VALUE_RE = re.compile(
+    r'(\d+\.?\d*)\s*(mega|meg|kilo|milli|micro|nano|pico|[kmunpµμ])?([a-zωΩµμ]*)',
+    re.IGNORECASE
+)
+_VALUE_MULTIPLIERS = {
+    'mega': 1e6, 'meg': 1e6, 'kilo': 1e3, 'k': 1e3, 'milli': 1e-3, 'm': 1e-3,
+    'micro': 1e-6, 'u': 1e-6, 'µ': 1e-6, 'μ': 1e-6,
+    'nano': 1e-9, 'n': 1e-9, 'pico': 1e-12, 'p': 1e-12,
+}
+# Unit assumed when only a multiplier is given ("10k", "47u")
+_BARE_MULTIPLIER_UNITS = {
+    'mega': 'ohm', 'meg': 'ohm', 'kilo': 'ohm', 'k': 'ohm', 'milli': 'ohm', 'm': 'ohm',
+    'micro': 'farad', 'u': 'farad', 'µ': 'farad', 'μ': 'farad',
+    'nano': 'farad', 'n': 'farad', 'pico': 'farad', 'p': 'farad',
+}
+
+@lru_cache(maxsize=1024)
+def _extract_component_value(value_str: str) -> Tuple[float, str]:
+    """
+    Extract numerical value and unit from component value string.
+    
+    Memoized, since the same few values ("10k", "100 ohm") recur across
+    components and analyses; the result is an immutable tuple.
+    """
+    match = _COMPONENT_VALUE_RE.match(value_str)
+    if not match:
+        return None, None
+    
+    value = float(match.group(1))
+    prefix = match.group(2)
+    unit = match.group(3)
+    
+    # Handle multipliers
+    if prefix:
+        prefix = prefix.lower()
+        value *= _VALUE_MULTIPLIERS[prefix]
+        if not unit:
+            unit = _BARE_MULTIPLIER_UNITS[prefix]
+    
+    return value, unit
+
 class CircuitValidationEngine:
     """Engine for validating circuit analysis results."""
     
-    def __init__(self):
-        """Initialize validation engine."""
-        # Common circuit patterns and rules
-        self.circuit_rules = {
-            'voltage_divider': {
-                'components': ['resistor', 'resistor'],
-                'connections': 'series',
-                'voltage_ratio': 'proportional_to_resistance'
-            },
-            'current_divider': {
-                'components': ['resistor', 'resistor'],
-                'connections': 'parallel',
-                'current_ratio': 'inversely_proportional_to_resistance'
-            },
-            'rc_circuit': {
-                'components': ['resistor', 'capacitor'],
-                'time_constant': 'R * C'
-            },
-            'rl_circuit': {
-                'components': ['resistor', 'inductor'],
-                'time_constant': 'L / R'
-            }
-        }
-        
-        # Component value ranges (typical values)
-        self.component_ranges = {
-            'resistor': {'min': 0.1, 'max': 1000000, 'unit': 'ohm'},
-            'capacitor': {'min': 0.000000001, 'max': 1, 'unit': 'farad'},
-            'inductor': {'min': 0.000001, 'max': 10, 'unit': 'henry'},
-            'voltage_source': {'min': 0.1, 'max': 1000000, 'unit': 'volt'},
-            'current_source': {'min': 0.000001, 'max': 100, 'unit': 'ampere'}
+    # Common circuit patterns and rules; like component_ranges below, fixed
+    # data shared by all engines instead of rebuilt in __init__
+    circuit_rules = {
+        'voltage_divider': {
+            'components': ['resistor', 'resistor'],
+            'connections': 'series',
+            'voltage_ratio': 'proportional_to_resistance'
+        },
+        'current_divider': {
+            'components': ['resistor', 'resistor'],
+            'connections': 'parallel',
+            'current_ratio': 'inversely_proportional_to_resistance'
+        },
+        'rc_circuit': {
+            'components': ['resistor', 'capacitor'],
+            'time_constant': 'R * C'
+        },
+        'rl_circuit': {
+            'components': ['resistor', 'inductor'],
+            'time_constant': 'L / R'
         }
+    }
+    
+    # (pattern, expected component types) pairs scanned by
+    # _validate_circuit_type, flattened once from circuit_rules
+    _rule_components = tuple(
+        (pattern, tuple(rules['components']))
+        for pattern, rules in circuit_rules.items()
+    )
+    
+    # Component value ranges (typical values)
+    component_ranges = {
+        'resistor': {'min': 0.1, 'max': 1000000, 'unit': 'ohm'},
+        'capacitor': {'min': 0.000000001, 'max': 1, 'unit': 'farad'},
+        'inductor': {'min': 0.000001, 'max': 10, 'unit': 'henry'},
+        'voltage_source': {'min': 0.1, 'max': 1000000, 'unit': 'volt'},
+        'current_source': {'min': 0.000001, 'max': 100, 'unit': 'ampere'}
+    }
     
     def validate_analysis(self, analysis: CircuitAnalysis) -> Dict[str, Any]:
         """
@@ -56,38 +115,36 @@ class CircuitValidationEngine:
             'suggestions': []
         }
         
+        # Each step appends its findings to validation_results directly
+        
         # 1. Validate circuit type consistency
-        circuit_validation = self._validate_circuit_type(analysis)
-        validation_results.update(circuit_validation)
+        self._validate_circuit_type(analysis, validation_results)
         
         # 2. Validate component values
-        component_validation = self._validate_component_values(analysis.components)
-        validation_results.update(component_validation)
+        self._validate_component_values(analysis.components, validation_results)
         
         # 3. Validate calculations
-        calculation_validation = self._validate_calculations(analysis.calculations)
-        validation_results.update(calculation_validation)
+        self._validate_calculations(analysis.calculations, validation_results)
         
         # 4. Validate physical consistency
-        physics_validation = self._validate_physics(analysis)
-        validation_results.update(physics_validation)
+        self._validate_physics(analysis, validation_results)
         
         # 5. Calculate confidence adjustment
         validation_results['confidence_adjustment'] = self._calculate_confidence_adjustment(validation_results)
         
         return validation_results
     
-    def _validate_circuit_type(self, analysis: CircuitAnalysis) -> Dict[str, Any]:
+    def _validate_circuit_type(self, analysis: CircuitAnalysis, results: Dict[str, Any]) -> None:
         """Validate circuit type and component consistency."""
-        results = {'warnings': [], 'errors': []}
-        
         circuit_type_lower = analysis.circuit_type.lower()
+        # Lowercased component names, built once the first rule matches
+        component_types = None
         
         # Check for common circuit patterns
-        for pattern, rules in self.circuit_rules.items():
+        for pattern, expected_types in self._rule_components:
             if pattern in circuit_type_lower:
                 # Validate component count
-                expected_components = len(rules['components'])
+                expected_components = len(expected_types)
                 actual_components = len(analysis.components)
                 
                 if actual_components < expected_components:
@@ -97,35 +154,30 @@ class CircuitValidationEngine:
                     )
                 
                 # Validate component types
-                component_types = [comp.name.lower() for comp in analysis.components]
-                for expected_type in rules['components']:
+                if component_types is None:
+                    component_types = {comp.name.lower() for comp in analysis.components}
+                for expected_type in expected_types:
                     if expected_type not in component_types:
                         results['warnings'].append(
                             f"Expected {expected_type} component for {pattern} circuit"
                         )
-        
-        return results
     
-    def _validate_component_values(self, components: List[CircuitComponent]) -> Dict[str, Any]:
+    def _validate_component_values(self, components: List[CircuitComponent], results: Dict[str, Any]) -> None:
         """Validate component values are within reasonable ranges."""
-        results = {'warnings': [], 'errors': []}
-        
         for component in components:
             comp_type = component.name.lower()
             value_str = component.value.lower()
             
-            # Extract numerical value and unit
-            value_info = self._extract_component_value(value_str)
-            if not value_info:
+            # Extract numerical value and unit; unparseable values come back
+            # as (None, None)
+            value, unit = _extract_component_value(value_str)
+            if value is None:
                 results['warnings'].append(f"Could not parse value for {component.name}: {component.value}")
                 continue
             
-            value, unit = value_info
-            
             # Check if component type is known
-            if comp_type in self.component_ranges:
-                expected_range = self.component_ranges[comp_type]
-                
+            expected_range = self.component_ranges.get(comp_type)
+            if expected_range is not None:
                 # Convert to base units for comparison
                 normalized_value = self._normalize_value(value, unit, expected_range['unit'])
                 
@@ -137,13 +189,9 @@ class CircuitValidationEngine:
                     results['warnings'].append(
                         f"{component.name} value {component.value} seems unusually high"
                     )
-        
-        return results
     
-    def _validate_calculations(self, calculations: List[str]) -> Dict[str, Any]:
+    def _validate_calculations(self, calculations: List[str], results: Dict[str, Any]) -> None:
         """Validate mathematical calculations for consistency."""
-        results = {'warnings': [], 'errors': []}
-        
         # Look for common calculation patterns
         for calc in calculations:
             calc_lower = calc.lower()
@@ -153,7 +201,8 @@ class CircuitValidationEngine:
                 results['errors'].append(f"Division by zero detected: {calc}")
             
             # Check for impossible results
-            if '= -' in calc and any(word in calc_lower for word in ['resistance', 'capacitance', 'inductance']):
+            if '= -' in calc and ('resistance' in calc_lower or 'capacitance' in calc_lower
+                                  or 'inductance' in calc_lower):
                 results['warnings'].append(f"Negative value for passive component: {calc}")
             
             # Check for unit consistency
@@ -161,79 +210,34 @@ class CircuitValidationEngine:
                 # RC time constant should be in seconds
                 if 'time' in calc_lower and 'second' not in calc_lower:
                     results['warnings'].append(f"Time constant calculation should result in seconds: {calc}")
-        
-        return results
     
-    def _validate_physics(self, analysis: CircuitAnalysis) -> Dict[str, Any]:
+    def _validate_physics(self, analysis: CircuitAnalysis, results: Dict[str, Any]) -> None:
         """Validate physical consistency of the circuit."""
-        results = {'warnings': [], 'errors': []}
-        
-        # Check for power conservation
-        if 'power' in analysis.analysis_summary.lower():
-            # Look for power calculations
-            power_pattern = r'power.*=.*(\d+\.?\d*)'
-            power_matches = re.findall(power_pattern, analysis.analysis_summary, re.IGNORECASE)
-            
-            if len(power_matches) > 1:
-                # Check if power values are reasonable
-                powers = [float(p) for p in power_matches]
-                if max(powers) > 1000:  # More than 1kW
-                    results['warnings'].append("High power values detected - verify component ratings")
+        # Every quoted quantity has an "=", so without one there is nothing to scan
+        if '=' not in analysis.analysis_summary:
+            return
         
-        # Check for voltage/current relationships
-        if 'voltage' in analysis.analysis_summary.lower() and 'current' in analysis.analysis_summary.lower():
-            # Ohm's law validation
-            voltage_pattern = r'voltage.*=.*(\d+\.?\d*)'
-            current_pattern = r'current.*=.*(\d+\.?\d*)'
-            resistance_pattern = r'resistance.*=.*(\d+\.?\d*)'
-            
-            voltages = re.findall(voltage_pattern, analysis.analysis_summary, re.IGNORECASE)
-            currents = re.findall(current_pattern, analysis.analysis_summary, re.IGNORECASE)
-            resistances = re.findall(resistance_pattern, analysis.analysis_summary, re.IGNORECASE)
-            
-            if voltages and currents and resistances:
-                try:
-                    v = float(voltages[0])
-                    i = float(currents[0])
-                    r = float(resistances[0])
-                    
-                    # Check if V = I * R holds approximately
-                    if abs(v - (i * r)) > 0.1 * v:  # 10% tolerance
-                        results['warnings'].append("Voltage/current/resistance relationship may be inconsistent")
-                except ValueError:
-                    pass
-        
-        return results
-    
-    def _extract_component_value(self, value_str: str) -> Tuple[float, str]:
-        """Extract numerical value and unit from component value string."""
-        # Common patterns: "100 ohm", "10k", "47μF", "1.5V"
-        patterns = [
-            r'(\d+\.?\d*)\s*([a-zA-ZΩμμ]+)',  # "100 ohm", "47μF"
-            r'(\d+\.?\d*)([kmμ])',  # "10k", "47μ"
-            r'(\d+\.?\d*)([VvAa])',  # "1.5V", "100mA"
-        ]
+        # Collect every quoted quantity in one pass, converting each value
+        # once; the keywords all start with a different letter, which is
+        # used as the bucket key. The value pattern only matches decimal
+        # digits, which float() always accepts.
+        quantities = {'p': [], 'v': [], 'c': [], 'r': []}
+        for match in _QUANTITY_RE.finditer(analysis.analysis_summary):
+            quantities[match.group('kind')[0].lower()].append(float(match.group('value')))
+        powers, voltages, currents, resistances = (quantities[k] for k in 'pvcr')
         
-        for pattern in patterns:
-            match = re.match(pattern, value_str)
-            if match:
-                value = float(match.group(1))
-                unit = match.group(2)
-                
-                # Handle multipliers
-                if unit.lower() == 'k':
-                    value *= 1000
-                    unit = 'ohm'
-                elif unit.lower() == 'm':
-                    value *= 0.001
-                    unit = 'ohm'
-                elif unit.lower() == 'μ' or unit.lower() == 'u':
-                    value *= 0.000001
-                    unit = 'farad'
-                
-                return value, unit
+        # Check for power conservation
+        if len(powers) > 1:
+            # Check if power values are reasonable
+            if max(powers) > 1000:  # More than 1kW
+                results['warnings'].append("High power values detected - verify component ratings")
         
-        return None, None
+        # Check for voltage/current relationships (Ohm's law); the quoted
+        # values are paired in order of appearance, and every complete
+        # triple is checked, not only the first
+        if any(abs(v - (i * r)) > 0.1 * v  # 10% tolerance
+               for v, i, r in zip(voltages, currents, resistances)):
+            results['warnings'].append("Voltage/current/resistance relationship may be inconsistent")
     
     def _normalize_value(self, value: float, from_unit: str, to_unit: str) -> float:
         """Convert value between units for comparison."""
@@ -247,48 +251,35 @@ class CircuitValidationEngine:
     
     def _calculate_confidence_adjustment(self, validation_results: Dict[str, Any]) -> float:
         """Calculate confidence adjustment based on validation results."""
-        adjustment = 0.0
-        
-        # Penalize for errors
-        adjustment -= len(validation_results['errors']) * 0.2
+        error_count = len(validation_results['errors'])
+        warning_count = len(validation_results['warnings'])
         
-        # Penalize for warnings
-        adjustment -= len(validation_results['warnings']) * 0.1
-        
-        # Bonus for passing all validations
-        if not validation_results['errors'] and not validation_results['warnings']:
-            adjustment += 0.1
+        # Penalize for errors and warnings; bonus for passing all validations
+        if error_count or warning_count:
+            adjustment = -0.2 * error_count - 0.1 * warning_count
+        else:
+            adjustment = 0.1
         
         return max(-0.5, min(0.2, adjustment))  # Limit adjustment to [-0.5, 0.2]
     
     def generate_validation_report(self, validation_results: Dict[str, Any]) -> str:
         """Generate a human-readable validation report."""
-        report = "## 🔍 Validation Report\n\n"
+        parts = ["## 🔍 Validation Report\n\n"]
         
         if validation_results['overall_valid']:
-            report += "✅ **Overall Validation: PASSED**\n\n"
+            parts.append("✅ **Overall Validation: PASSED**\n\n")
         else:
-            report += "❌ **Overall Validation: FAILED**\n\n"
+            parts.append("❌ **Overall Validation: FAILED**\n\n")
         
         if validation_results['confidence_adjustment'] != 0:
-            report += f"📊 **Confidence Adjustment:** {validation_results['confidence_adjustment']:+.2f}\n\n"
-        
-        if validation_results['errors']:
-            report += "### ❌ Errors Found:\n"
-            for error in validation_results['errors']:
-                report += f"- {error}\n"
-            report += "\n"
-        
-        if validation_results['warnings']:
-            report += "### ⚠️ Warnings:\n"
-            for warning in validation_results['warnings']:
-                report += f"- {warning}\n"
-            report += "\n"
+            parts.append(f"📊 **Confidence Adjustment:** {validation_results['confidence_adjustment']:+.2f}\n\n")
         
-        if validation_results['suggestions']:
-            report += "### 💡 Suggestions:\n"
-            for suggestion in validation_results['suggestions']:
-                report += f"- {suggestion}\n"
-            report += "\n"
+        for key, heading in (('errors', "### ❌ Errors Found:\n"),
+                             ('warnings', "### ⚠️ Warnings:\n"),
+                             ('suggestions', "### 💡 Suggestions:\n")):
+            if validation_results[key]:
+                parts.append(heading)
+                parts.extend(f"- {item}\n" for item in validation_results[key])
+                parts.append("\n")
         
-        return report
+        return ''.join(parts)